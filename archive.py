@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from typing import AsyncGenerator, NamedTuple, Optional
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+logger = logging.getLogger(__name__)
+
+# Константы для сборки архивов
+ZIP_CONCURRENCY = 4  # Сколько файлов скачивается одновременно
+ZIP_MAX_ACTIVE = 2  # Сколько архивов собирается одновременно на весь бот
+ZIP_MAX_FILES = 200  # Максимум файлов в одном архиве
+ZIP_MAX_SIZE = 50 * 1024 * 1024  # Лимит Telegram на отправку файла ботом
+FILE_SPOOL_SIZE = 1024 * 1024  # Файл больше этого размера при скачивании уходит на диск
+ARCHIVE_SPOOL_SIZE = 8 * 1024 * 1024  # То же для самого архива
+COPY_CHUNK_SIZE = 64 * 1024
+# Служебные данные ZIP: локальный заголовок и запись центрального каталога на каждый файл
+# (плюс имя файла в обоих), и завершающая запись каталога на весь архив
+ZIP_ENTRY_OVERHEAD = 30 + 46
+ZIP_END_SIZE = 22
+
+UNSAFE_NAME_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+class ZipEntry(NamedTuple):
+    file_id: str
+    name: str  # путь внутри архива без расширения
+
+
+def safe_name(title: str) -> str:
+    """Убирает из заголовка символы, недопустимые в именах файлов."""
+    return UNSAFE_NAME_RE.sub("_", title).strip(". ") or "_"
+
+
+def make_entries(rows) -> list[ZipEntry]:
+    """
+    Превращает строки с id, file_id, title и dirs (заголовки папок от корня архива)
+    в записи архива. id в имени не даёт совпасть одноимённым файлам.
+    """
+    entries = []
+    for row in rows:
+        parts = [safe_name(d) for d in row["dirs"]]
+        parts.append(f"{row['id']}_{safe_name(row['title'])}")
+        entries.append(ZipEntry(row["file_id"], "/".join(parts)))
+    return entries
+
+
+class SpooledInputFile(InputFile):
+    """Отправляет в Telegram уже открытый файл (например, SpooledTemporaryFile) по частям."""
+
+    def __init__(self, file, filename: str, chunk_size: int = COPY_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+
+def copy_to_zip(zf: zipfile.ZipFile, name: str, buffer):
+    buffer.seek(0)
+    # Медиа уже сжаты, поэтому кладём как есть — это быстрее и почти не больше
+    with zf.open(zipfile.ZipInfo(name), "w") as dest:
+        shutil.copyfileobj(buffer, dest, COPY_CHUNK_SIZE)
+
+
+async def write_zip(bot: Bot, entries: list[ZipEntry], archive) -> tuple[int, list[str]]:
+    """
+    Скачивает файлы entries не более чем в ZIP_CONCURRENCY потоков и пишет их в archive.
+    Очередь между загрузкой и записью ограничена, поэтому скачанные, но не записанные
+    файлы не накапливаются. Возвращает число записанных файлов и имена пропущенных.
+    """
+    queue: asyncio.Queue[tuple[str, Optional[tempfile.SpooledTemporaryFile]]] = asyncio.Queue(ZIP_CONCURRENCY)
+    pending = iter(entries)
+
+    async def download_worker():
+        for entry in pending:
+            buffer = tempfile.SpooledTemporaryFile(max_size=FILE_SPOOL_SIZE)
+            try:
+                file = await bot.get_file(entry.file_id)
+                if file.file_size and file.file_size > ZIP_MAX_SIZE:
+                    raise ValueError(f"файл слишком большой: {file.file_size} байт")
+                await bot.download_file(file.file_path, destination=buffer)
+            except Exception as e:
+                logger.warning(f"Не удалось скачать {entry.name}: {e}")
+                buffer.close()
+                await queue.put((entry.name, None))
+                continue
+            await queue.put((entry.name + os.path.splitext(file.file_path)[1], buffer))
+
+    workers = [asyncio.create_task(download_worker()) for _ in range(ZIP_CONCURRENCY)]
+    written, skipped, total_size = 0, [], ZIP_END_SIZE
+    try:
+        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED) as zf:
+            for _ in entries:
+                name, buffer = await queue.get()
+                if buffer is None:
+                    skipped.append(name)
+                    continue
+                with buffer:
+                    size = buffer.seek(0, os.SEEK_END) + ZIP_ENTRY_OVERHEAD + 2 * len(name.encode())
+                    if total_size + size > ZIP_MAX_SIZE:
+                        skipped.append(name)
+                        continue
+                    # zipfile синхронный, поэтому запись идёт в отдельном потоке
+                    await asyncio.to_thread(copy_to_zip, zf, name, buffer)
+                total_size += size
+                written += 1
+    finally:
+        for worker in workers:
+            worker.cancel()
+    return written, skipped
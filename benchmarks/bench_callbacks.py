@@ -0,0 +1,88 @@
+"""
+Микробенчмарк разбора callback-кнопок: цепочка F.data.startswith + split/int
+против одного фильтра NodeCallback с таблицей обработчиков.
+
+Запуск: python -m benchmarks.bench_callbacks
+"""
+import asyncio
+import time
+
+from aiogram import Router, F
+from aiogram.types import CallbackQuery, User
+
+from handlers.callbacks import NodeAction, NodeCallback
+
+ITERATIONS = 20000
+
+
+def legacy_router() -> Router:
+    """Роутер в старом стиле: четыре startswith-фильтра и ручной разбор строки."""
+    router = Router()
+
+    @router.callback_query(F.data.startswith("view_"))
+    async def view(callback: CallbackQuery):
+        return int(callback.data.split("_", 1)[1])
+
+    @router.callback_query(F.data.startswith("rm_"))
+    async def rm(callback: CallbackQuery):
+        return int(callback.data[3:])
+
+    @router.callback_query(F.data == "cd_root")
+    async def cd_root(callback: CallbackQuery):
+        return None
+
+    @router.callback_query(F.data.startswith("cd_") & F.data.len() > 3)
+    async def cd(callback: CallbackQuery):
+        return int(callback.data[3:])
+
+    @router.callback_query(F.data.startswith("edit_"))
+    async def edit(callback: CallbackQuery):
+        return int(callback.data.split("_", 1)[1])
+
+    return router
+
+
+def table_router() -> Router:
+    """Роутер в новом стиле: один фильтр NodeCallback и словарь действий."""
+    router = Router()
+
+    async def handle(callback: CallbackQuery, node_id):
+        return node_id
+
+    handlers = {action: handle for action in NodeAction}
+
+    @router.callback_query(NodeCallback.filter())
+    async def node_callback(callback: CallbackQuery, callback_data: NodeCallback):
+        return await handlers[callback_data.action](callback, callback_data.node_id)
+
+    return router
+
+
+def make_callback(data: str) -> CallbackQuery:
+    user = User(id=1, is_bot=False, first_name="bench")
+    return CallbackQuery(id="1", from_user=user, chat_instance="bench", data=data)
+
+
+async def measure(router: Router, payloads: list[str]) -> float:
+    """Возвращает среднее время обработки одного callback в микросекундах."""
+    events = [make_callback(data) for data in payloads]
+    started = time.perf_counter()
+    for i in range(ITERATIONS):
+        await router.propagate_event(update_type="callback_query", event=events[i % len(events)])
+    return (time.perf_counter() - started) / ITERATIONS * 1e6
+
+
+async def main():
+    legacy_payloads = ["view_123", "rm_123", "cd_123", "edit_123"]
+    table_payloads = [
+        NodeCallback(action=action, node_id=123).pack()
+        for action in (NodeAction.VIEW, NodeAction.REMOVE, NodeAction.CD, NodeAction.EDIT)
+    ]
+    before = await measure(legacy_router(), legacy_payloads)
+    after = await measure(table_router(), table_payloads)
+    print(f"startswith-цепочка: {before:.1f} мкс/callback")
+    print(f"NodeCallback + таблица: {after:.1f} мкс/callback")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
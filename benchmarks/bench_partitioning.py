@@ -0,0 +1,110 @@
+"""
+Бенчмарк задержек get_children и search_nodes на обычной таблице
+и на таблице, секционированной по HASH(user_id).
+
+Создаёт схему bench в базе из .env, заполняет обе таблицы одинаковыми
+данными и удаляет схему по завершении.
+
+Запуск: python -m benchmarks.bench_partitioning [--rows 5000000] [--users 10000] [--partitions 16]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from db import init_db
+
+QUERIES = 500
+
+GET_CHILDREN_SQL = """
+    SELECT id, content, file_type FROM {table}
+    WHERE user_id = $1 AND parent_id IS NOT DISTINCT FROM $2 ORDER BY id
+"""
+SEARCH_SQL = """
+    SELECT id, content FROM {table}
+    WHERE user_id = $1 AND content ILIKE $2 ORDER BY id
+"""
+
+
+async def prepare(conn, rows: int, users: int, partitions: int):
+    await conn.execute("DROP SCHEMA IF EXISTS bench CASCADE")
+    await conn.execute("CREATE SCHEMA bench")
+    columns = """
+        id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        parent_id BIGINT,
+        content TEXT NOT NULL,
+        file_id TEXT,
+        file_type TEXT
+    """
+    await conn.execute(f"CREATE TABLE bench.nodes_plain ({columns}, PRIMARY KEY (id))")
+    await conn.execute(
+        f"CREATE TABLE bench.nodes_part ({columns}, PRIMARY KEY (user_id, id)) PARTITION BY HASH (user_id)"
+    )
+    for i in range(partitions):
+        await conn.execute(f"""
+            CREATE TABLE bench.nodes_part_{i} PARTITION OF bench.nodes_part
+            FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})
+        """)
+
+    # У каждого пользователя ~10 корневых папок, остальные узлы вложены в узел того же пользователя
+    fill = """
+        INSERT INTO {table}
+        SELECT g, g % $2,
+               CASE WHEN g > $2 * 10 THEN g - $2 * (1 + (g / $2) % 10) END,
+               md5(g::text), NULL, NULL
+        FROM generate_series(1, $1) AS g
+    """
+    for table in ("bench.nodes_plain", "bench.nodes_part"):
+        await conn.execute(fill.format(table=table), rows, users)
+        await conn.execute(f"CREATE INDEX ON {table} (user_id, parent_id, id)")
+        await conn.execute(f"ANALYZE {table}")
+
+
+async def measure(pool, sql: str, args_list: list[tuple]) -> tuple[float, float]:
+    """Возвращает p50 и p95 задержки запроса в миллисекундах."""
+    timings = []
+    async with pool.acquire() as conn:
+        for args in args_list:
+            started = time.perf_counter()
+            await conn.fetch(sql, *args)
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95)]
+
+
+async def run(rows: int, users: int, partitions: int):
+    pool = await init_db()
+    try:
+        async with pool.acquire() as conn:
+            await prepare(conn, rows, users, partitions)
+
+        rnd = random.Random(42)
+        children_args = [(rnd.randrange(users), None) for _ in range(QUERIES)]
+        children_args += [(uid, uid + users * rnd.randrange(1, 10)) for uid, _ in children_args]
+        search_args = [(rnd.randrange(users), f"%{rnd.choice('0123456789abcdef')}{rnd.choice('abcdef')}%")
+                       for _ in range(QUERIES)]
+
+        for table in ("bench.nodes_plain", "bench.nodes_part"):
+            p50, p95 = await measure(pool, GET_CHILDREN_SQL.format(table=table), children_args)
+            print(f"{table} get_children: p50 {p50:.2f} мс, p95 {p95:.2f} мс")
+            p50, p95 = await measure(pool, SEARCH_SQL.format(table=table), search_args)
+            print(f"{table} search_nodes: p50 {p50:.2f} мс, p95 {p95:.2f} мс")
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DROP SCHEMA IF EXISTS bench CASCADE")
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк секционирования nodes")
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--partitions", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.users, args.partitions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Бенчмарк сборки архива /zip на локальной заглушке Bot API:
+время, пропускная способность, пиковая память процесса и целостность архива.
+
+Запуск: python -m benchmarks.bench_zip [--files 100] [--size 262144]
+"""
+import argparse
+import asyncio
+import resource
+import tempfile
+import time
+import zipfile
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from archive import ARCHIVE_SPOOL_SIZE, ZipEntry, write_zip
+from tests.fake_bot_api import start_server
+
+
+async def run(files: int, size: int, missing: int):
+    runner, base_url = await start_server()
+    bot = Bot(token="42:bench", session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    entries = [ZipEntry(f"{size}_{i}", f"folder/{i}") for i in range(files)]
+    entries += [ZipEntry(f"missing_{i}", f"folder/missing_{i}") for i in range(missing)]
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as archive:
+            started = time.perf_counter()
+            written, skipped = await write_zip(bot, entries, archive)
+            elapsed = time.perf_counter() - started
+
+            archive.seek(0)
+            with zipfile.ZipFile(archive) as zf:
+                assert zf.testzip() is None
+                assert len(zf.namelist()) == written
+
+        megabytes = written * size / 1024 / 1024
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"Записано {written}, пропущено {len(skipped)}: {megabytes:.1f} МБ за {elapsed:.2f} с "
+              f"({megabytes / elapsed:.1f} МБ/с), пиковая память {peak_rss:.0f} МБ")
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сборки архива")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--size", type=int, default=256 * 1024)
+    parser.add_argument("--missing", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(run(args.files, args.size, args.missing))
+
+
+if __name__ == "__main__":
+    main()
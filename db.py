@@ -7,6 +7,8 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+DB_POOL_MAX_SIZE = 20  # Максимум соединений в пуле
+
 async def init_db():
     try:
         pool = await asyncpg.create_pool(
@@ -16,7 +18,7 @@ async def init_db():
             password=os.getenv("DB_PASSWORD", ""),
             database=os.getenv("DB_NAME", "postgres"),
             min_size=5,
-            max_size=20,
+            max_size=DB_POOL_MAX_SIZE,
             command_timeout=60
         )
 
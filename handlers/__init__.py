@@ -1,20 +1,37 @@
-from aiogram import Router, F
+from aiogram import Bot, Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
+from aiogram.dispatcher.event.handler import CallableObject
 from aiogram.fsm.context import FSMContext
 from typing import Optional
+import asyncio
+import html
 import logging
 import re
+import tempfile
 
 from handlers.states import AddNode, EditNode, SearchQuery
+from handlers.callbacks import NodeAction, NodeCallback
+from log_config import handler_var
+from archive import (
+    ARCHIVE_SPOOL_SIZE, ZIP_MAX_ACTIVE, ZIP_MAX_FILES, SpooledInputFile, ZipEntry, make_entries, safe_name, write_zip,
+)
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 # Константы для ограничений
-MAX_CONTENT_LENGTH = 2000  # Максимальная длина содержимого узла
+MAX_CONTENT_LENGTH = 4096  # Максимальная длина содержимого узла (лимит сообщения Telegram)
+MAX_CAPTION_LENGTH = 1024  # Лимит подписи к медиа в Telegram
+TITLE_LENGTH = 64  # Длина заголовка узла в списках и поиске
+MAX_TAG_LENGTH = 32  # Максимальная длина тега
+MAX_TAGS_PER_NODE = 20  # Максимальное количество тегов у узла
+MAX_TAGS_LISTED = 100  # Сколько тегов показывает /tags
+RECENT_IN_MENU = 3  # Сколько недавних папок показывать в /menu
 MAX_SEARCH_QUERY_LENGTH = 100  # Максимальная длина поискового запроса
 
+TAG_RE = re.compile(rf"^[\w-]{{1,{MAX_TAG_LENGTH}}}$")
+
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 
 def validate_content(content: str) -> bool:
@@ -25,6 +42,32 @@ def validate_content(content: str) -> bool:
         return False
     return True
 
+def make_title(content: str) -> str:
+    """Возвращает короткий заголовок узла: первая строка, обрезанная до TITLE_LENGTH"""
+    first_line = content.split("\n", 1)[0]
+    if len(first_line) > TITLE_LENGTH:
+        return first_line[:TITLE_LENGTH - 1] + "…"
+    return first_line
+
+def make_title_fields(content: str) -> tuple[str, bool]:
+    """Возвращает заголовок и признак title_truncated: content не совпадает с заголовком"""
+    title = make_title(content)
+    return title, title != content
+
+def parse_tags(words: list[str]) -> Optional[list[str]]:
+    """
+    Приводит теги к виду без '#' в нижнем регистре.
+    Возвращает None, если хотя бы один тег недопустим.
+    """
+    tags = []
+    for word in words:
+        tag = word.lstrip("#").lower()
+        if not TAG_RE.match(tag):
+            return None
+        if tag not in tags:
+            tags.append(tag)
+    return tags
+
 def validate_search_query(query: str) -> bool:
     """Проверяет, соответствует ли поисковый запрос требованиям"""
     if not query or len(query.strip()) < 2:
@@ -35,18 +78,71 @@ def validate_search_query(query: str) -> bool:
 
 
 async def get_children(pool, user_id: int, parent_id: Optional[int]):
+    """
+    Возвращает дочерние узлы без content: только заголовок и признак,
+    что текст длиннее заголовка. Все поля есть в индексе, поэтому таблица не читается.
+    """
     async with pool.acquire() as conn:
         rows = await conn.fetch(
-            "SELECT id, content, file_type FROM nodes WHERE user_id = $1 AND parent_id IS NOT DISTINCT FROM $2 ORDER BY id",
+            """
+            SELECT id, title, title_truncated, file_type
+            FROM nodes
+            WHERE user_id = $1 AND parent_id IS NOT DISTINCT FROM $2
+            ORDER BY id
+            """,
             user_id, parent_id
         )
         return rows
 
+async def get_node_content(pool, user_id: int, node_id: int) -> Optional[str]:
+    """Загружает полный текст узла, если он принадлежит пользователю."""
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT content FROM nodes WHERE id = $1 AND user_id = $2",
+            node_id, user_id
+        )
+
+async def get_folder_titles(pool, user_id: int, folder_ids: list[int]) -> dict[int, str]:
+    """Возвращает заголовки папок пользователя из списка: {id: title}. Медиа и чужие узлы пропускаются."""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT id, title FROM nodes WHERE user_id = $1 AND id = ANY($2::bigint[]) AND file_type IS NULL",
+            user_id, folder_ids
+        )
+        return {row["id"]: row["title"] for row in rows}
+
+async def get_subtree_files(pool, user_id: int, folder_id: int, limit: int):
+    """
+    Возвращает медиа из поддерева папки: id, file_id, title и dirs —
+    заголовки вложенных папок от folder_id до файла.
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            WITH RECURSIVE tree AS (
+                SELECT id, user_id, file_id, file_type, title, ARRAY[]::text[] AS dirs
+                FROM nodes
+                WHERE user_id = $1 AND parent_id = $2
+                UNION ALL
+                SELECT n.id, n.user_id, n.file_id, n.file_type, n.title, t.dirs || t.title
+                FROM nodes n
+                INNER JOIN tree t ON n.parent_id = t.id AND n.user_id = t.user_id
+                WHERE t.file_type IS NULL
+            )
+            SELECT id, file_id, title, dirs FROM tree
+            WHERE file_id IS NOT NULL
+            ORDER BY dirs, id
+            LIMIT $3
+        """, user_id, folder_id, limit)
+
 async def create_node(pool, user_id: int, parent_id: Optional[int], content: str):
     async with pool.acquire() as conn:
         row = await conn.fetchrow(
-            "INSERT INTO nodes (user_id, parent_id, content) VALUES ($1, $2, $3) RETURNING id",
-            user_id, parent_id, content
+            """
+            INSERT INTO nodes (user_id, parent_id, content, title, title_truncated)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING id
+            """,
+            user_id, parent_id, content, *make_title_fields(content)
         )
         return row["id"]
 
@@ -54,11 +150,11 @@ async def create_node_with_file(pool, user_id: int, parent_id: Optional[int], co
     async with pool.acquire() as conn:
         row = await conn.fetchrow(
             """
-            INSERT INTO nodes (user_id, parent_id, content, file_id, file_type)
-            VALUES ($1, $2, $3, $4, $5)
+            INSERT INTO nodes (user_id, parent_id, content, title, title_truncated, file_id, file_type)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
             RETURNING id
             """,
-            user_id, parent_id, content, file_id, file_type
+            user_id, parent_id, content, *make_title_fields(content), file_id, file_type
         )
         return row["id"]
 
@@ -81,46 +177,89 @@ async def update_node_content(pool, user_id: int, node_id: int, new_content: str
         return False
     async with pool.acquire() as conn:
         result = await conn.execute(
-            "UPDATE nodes SET content = $1 WHERE id = $2 AND user_id = $3",
-            new_content.strip(), node_id, user_id
+            "UPDATE nodes SET content = $1, title = $2, title_truncated = $3 WHERE id = $4 AND user_id = $5",
+            new_content.strip(), *make_title_fields(new_content.strip()), node_id, user_id
         )
         return "UPDATE 0" not in result
 
-async def build_path_to_node(pool, node_id: int) -> str:
+async def build_path_to_node(pool, user_id: int, node_id: int) -> str:
     """Возвращает путь к узлу в виде 'Корень → Папка → Узел'."""
     async with pool.acquire() as conn:
-        # Рекурсивный запрос: поднимаемся вверх по parent_id
+        # Рекурсивный запрос: поднимаемся вверх по parent_id.
+        # Условие на user_id позволяет читать только секцию пользователя.
         path_rows = await conn.fetch("""
             WITH RECURSIVE path AS (
-                SELECT id, parent_id, content, 0 AS level
+                SELECT id, user_id, parent_id, title, 0 AS level
                 FROM nodes
-                WHERE id = $1
+                WHERE id = $1 AND user_id = $2
                 UNION ALL
-                SELECT n.id, n.parent_id, n.content, p.level + 1
+                SELECT n.id, n.user_id, n.parent_id, n.title, p.level + 1
                 FROM nodes n
-                INNER JOIN path p ON n.id = p.parent_id
+                INNER JOIN path p ON n.id = p.parent_id AND n.user_id = p.user_id
             )
-            SELECT content FROM path
+            SELECT title FROM path
             ORDER BY level DESC
-        """, node_id)
+        """, node_id, user_id)
 
         if not path_rows:
             return "Неизвестный путь"
 
-        contents = [row["content"] for row in path_rows]
-        return " → ".join(contents)
+        titles = [row["title"] for row in path_rows]
+        return " → ".join(titles)
 
 async def search_nodes(pool, user_id: int, query: str):
     """Ищет узлы пользователя, содержащие query в content (регистронезависимо)."""
     async with pool.acquire() as conn:
         rows = await conn.fetch("""
-            SELECT id, content
+            SELECT id, title
             FROM nodes
             WHERE user_id = $1 AND content ILIKE $2
             ORDER BY id
         """, user_id, f"%{query}%")
         return rows
 
+async def update_node_tags(pool, user_id: int, node_id: int, add: list[str], remove: list[str]) -> Optional[list[str]]:
+    """
+    Добавляет и удаляет теги узла. Возвращает итоговый список тегов
+    или None, если узел не найден или тегов стало больше MAX_TAGS_PER_NODE.
+    """
+    async with pool.acquire() as conn:
+        return await conn.fetchval("""
+            UPDATE nodes SET tags = t.new_tags
+            FROM (
+                SELECT ARRAY(
+                    SELECT DISTINCT x FROM unnest(tags || $3::text[]) AS x
+                    WHERE x <> ALL($4::text[])
+                    ORDER BY x
+                ) AS new_tags
+                FROM nodes
+                WHERE id = $1 AND user_id = $2
+            ) AS t
+            WHERE id = $1 AND user_id = $2 AND cardinality(t.new_tags) <= $5
+            RETURNING nodes.tags
+        """, node_id, user_id, add, remove, MAX_TAGS_PER_NODE)
+
+async def find_nodes_by_tags(pool, user_id: int, tags: list[str]):
+    """Ищет узлы пользователя, у которых есть все указанные теги (через GIN-индекс по tags)."""
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT id, title
+            FROM nodes
+            WHERE user_id = $1 AND tags @> $2::text[]
+            ORDER BY id
+        """, user_id, tags)
+
+async def get_tag_counts(pool, user_id: int):
+    """Возвращает теги пользователя с количеством узлов из таблицы tag_counts."""
+    async with pool.acquire() as conn:
+        return await conn.fetch("""
+            SELECT tag, count
+            FROM tag_counts
+            WHERE user_id = $1
+            ORDER BY count DESC, tag
+            LIMIT $2
+        """, user_id, MAX_TAGS_LISTED)
+
 #СОХРАНЕНИЕ МЕДИА
 @router.message(F.document)
 async def handle_document(message: Message, state: FSMContext, db_pool):
@@ -160,11 +299,11 @@ async def handle_photo(message: Message, state: FSMContext, db_pool):
     async with db_pool.acquire() as conn:
         row = await conn.fetchrow(
             """
-            INSERT INTO nodes (user_id, parent_id, content, file_id, file_type)
-            VALUES ($1, $2, $3, $4, $5)
+            INSERT INTO nodes (user_id, parent_id, content, title, title_truncated, file_id, file_type)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
             RETURNING id
             """,
-            user_id, current_folder_id, caption, file_id, "photo"
+            user_id, current_folder_id, caption, *make_title_fields(caption), file_id, "photo"
         )
     node_id = row["id"]
     await message.answer(f"🖼️ Фото сохранено! ID: {node_id}")
@@ -231,11 +370,8 @@ async def handle_animation(message: Message, state: FSMContext, db_pool):
     node_id = await create_node_with_file(db_pool, user_id, current_folder_id, caption, file_id, "animation")
     await message.answer(f"🎬 Анимация сохранена! ID: {node_id}")
 
-@router.callback_query(F.data.startswith("view_"))
-async def view_media(callback: CallbackQuery, db_pool):
-    try:
-        node_id = int(callback.data.split("_", 1)[1])
-    except (ValueError, IndexError):
+async def view_media(callback: CallbackQuery, node_id: Optional[int], state: FSMContext, db_pool):
+    if node_id is None:
         await callback.answer("Неверный ID узла.", show_alert=True)
         return
 
@@ -251,7 +387,7 @@ async def view_media(callback: CallbackQuery, db_pool):
 
     file_id = row["file_id"]
     file_type = row["file_type"]
-    caption = row["content"]
+    caption = row["content"][:MAX_CAPTION_LENGTH]
 
     try:
         if file_type == "photo":
@@ -274,6 +410,21 @@ async def view_media(callback: CallbackQuery, db_pool):
 
     await callback.answer()
 
+#ОТКРЫТИЕ ЗАМЕТКИ
+# Полный текст загружается только здесь, списки и поиск работают с заголовками
+async def open_note(callback: CallbackQuery, node_id: Optional[int], state: FSMContext, db_pool):
+    if node_id is None:
+        await callback.answer("Неверный ID узла.", show_alert=True)
+        return
+
+    content = await get_node_content(db_pool, callback.from_user.id, node_id)
+    if content is None:
+        await callback.answer("Узел не найден или не принадлежит вам.", show_alert=True)
+        return
+
+    await callback.message.answer(content)
+    await callback.answer()
+
 #ФУНКЦИЯ СТАРТА
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext, db_pool):
@@ -284,11 +435,8 @@ async def cmd_start(message: Message, state: FSMContext, db_pool):
     await cmd_ls(message, state, db_pool)
 
 #УДАЛЕНИЕ ПАПКИ
-@router.callback_query(F.data.startswith("rm_"))
-async def rm_callback(callback: CallbackQuery, state: FSMContext, db_pool):
-    try:
-        node_id = int(callback.data[3:])
-    except ValueError:
+async def rm_callback(callback: CallbackQuery, node_id: Optional[int], state: FSMContext, db_pool):
+    if node_id is None:
         await callback.answer("Неверный ID узла.", show_alert=True)
         return
 
@@ -314,8 +462,8 @@ async def cmd_ls(message: Message, state: FSMContext, db_pool):
     if current_folder_id is None:
         text = "📂 <b>Корневая папка</b>\n\n"
     else:
-        path = await build_path_to_node(db_pool, current_folder_id)
-        text = f"📂 <b>Текущая папка:</b>\n{path}\n\n"
+        path = await build_path_to_node(db_pool, user_id, current_folder_id)
+        text = f"📂 <b>Текущая папка:</b>\n{html.escape(path)}\n\n"
 
     node_buttons = []
     if not children:
@@ -324,7 +472,7 @@ async def cmd_ls(message: Message, state: FSMContext, db_pool):
         text += "Содержимое:\n\n"
         for row in children:
             node_id = row["id"]
-            content = row["content"]
+            title = row["title"]
             file_type = row.get("file_type")
 
             if file_type == "document":
@@ -342,24 +490,45 @@ async def cmd_ls(message: Message, state: FSMContext, db_pool):
             else:
                 prefix = "📁"
 
-            text += f"{prefix} {content}\n"
+            # Сообщение уходит с parse_mode="HTML", а обрезанный заголовок может содержать половину разметки
+            text += f"{prefix} {html.escape(title)}\n"
 
             buttons_row = []
 
             if file_type is not None:
                 buttons_row.append(
-                    InlineKeyboardButton(text="👁️ Просмотр", callback_data=f"view_{node_id}")
+                    InlineKeyboardButton(
+                        text="👁️ Просмотр",
+                        callback_data=NodeCallback(action=NodeAction.VIEW, node_id=node_id).pack()
+                    )
                 )
             else:
                 buttons_row.append(
-                    InlineKeyboardButton(text=content, callback_data=f"cd_{node_id}")
+                    InlineKeyboardButton(
+                        text=title,
+                        callback_data=NodeCallback(action=NodeAction.CD, node_id=node_id).pack()
+                    )
+                )
+
+            if row["title_truncated"]:
+                buttons_row.append(
+                    InlineKeyboardButton(
+                        text="📖",
+                        callback_data=NodeCallback(action=NodeAction.OPEN, node_id=node_id).pack()
+                    )
                 )
 
             buttons_row.append(
-                InlineKeyboardButton(text="✏️ Ред.", callback_data=f"edit_{node_id}")
+                InlineKeyboardButton(
+                    text="✏️ Ред.",
+                    callback_data=NodeCallback(action=NodeAction.EDIT, node_id=node_id).pack()
+                )
             )
             buttons_row.append(
-                InlineKeyboardButton(text="🗑️ Удалить", callback_data=f"rm_{node_id}")
+                InlineKeyboardButton(
+                    text="🗑️ Удалить",
+                    callback_data=NodeCallback(action=NodeAction.REMOVE, node_id=node_id).pack()
+                )
             )
 
             node_buttons.append(buttons_row)
@@ -370,7 +539,7 @@ async def cmd_ls(message: Message, state: FSMContext, db_pool):
     ]
     if current_folder_id is not None:
         action_buttons.append(
-            InlineKeyboardButton(text="↑ В корень", callback_data="cd_root")
+            InlineKeyboardButton(text="↑ В корень", callback_data=NodeCallback(action=NodeAction.CD).pack())
         )
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=node_buttons + [action_buttons])
@@ -378,10 +547,10 @@ async def cmd_ls(message: Message, state: FSMContext, db_pool):
     await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
 # ВОЗВРАТ В КОРЕНЬ
-@router.callback_query(F.data == "cd_root")
 async def cd_to_root(callback: CallbackQuery, state: FSMContext, db_pool):
     await state.update_data(current_folder_id=None)
     await cmd_ls(callback.message, state, db_pool)
+    await callback.answer()
 
 @router.message(Command("root"))
 async def cmd_root(message: Message, state: FSMContext, db_pool):
@@ -390,13 +559,9 @@ async def cmd_root(message: Message, state: FSMContext, db_pool):
 
 #ПЕРЕМЕЩЕНИЕ ПО ПАПКАМ
 #Вызывается при переходе в папке по кнопкам
-@router.callback_query(F.data.startswith("cd_") & F.data.len() > 3)
-async def cd_to_folder(callback: CallbackQuery, state: FSMContext, db_pool):
-    try:
-        folder_id = int(callback.data[3:])
-        print(callback.data[3:])
-    except ValueError:
-        await callback.answer("Неверный ID папки.", show_alert=True)
+async def cd_to_folder(callback: CallbackQuery, folder_id: Optional[int], state: FSMContext, db_pool, recent_folders):
+    if folder_id is None:
+        await cd_to_root(callback, state, db_pool)
         return
 
     user_id = callback.from_user.id
@@ -417,6 +582,7 @@ async def cd_to_folder(callback: CallbackQuery, state: FSMContext, db_pool):
 
     # Устанавливаем новую текущую папку и обновляем отображение
     await state.update_data(current_folder_id=folder_id)
+    await recent_folders.visit(user_id, folder_id)
     await cmd_ls(callback.message, state, db_pool)
     await callback.answer()
 
@@ -460,8 +626,7 @@ async def cd_to_folder(callback: CallbackQuery, state: FSMContext, db_pool):
 
 #Вызывается при вызове через чат
 @router.message(Command("cd"))
-async def cmd_cd(message: Message, state: FSMContext, db_pool):
-    print("cmd_cd")
+async def cmd_cd(message: Message, state: FSMContext, db_pool, recent_folders):
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
         await message.answer("Использование: /cd <ID_папки>")
@@ -488,8 +653,111 @@ async def cmd_cd(message: Message, state: FSMContext, db_pool):
         return
 
     await state.update_data(current_folder_id=folder_id)
+    await recent_folders.visit(user_id, folder_id)
     await cmd_ls(message, state, db_pool)
 
+#НЕДАВНИЕ ПАПКИ
+async def recent_folder_buttons(db_pool, recent_folders, user_id: int, count: Optional[int] = None):
+    """
+    Возвращает ряды кнопок для перехода в недавние папки одним нажатием.
+    Папки, которых больше нет, убираются из списка недавних.
+    """
+    folder_ids = await recent_folders.get(user_id, count)
+    if not folder_ids:
+        return []
+
+    titles = await get_folder_titles(db_pool, user_id, folder_ids)
+    await recent_folders.forget(user_id, [fid for fid in folder_ids if fid not in titles])
+
+    return [
+        [InlineKeyboardButton(
+            text=f"🕘 {titles[fid]}",
+            callback_data=NodeCallback(action=NodeAction.CD, node_id=fid).pack()
+        )]
+        for fid in folder_ids if fid in titles
+    ]
+
+@router.message(Command("recent"))
+async def cmd_recent(message: Message, db_pool, recent_folders):
+    buttons = await recent_folder_buttons(db_pool, recent_folders, message.from_user.id)
+    if not buttons:
+        await message.answer("🕘 Недавних папок пока нет.")
+        return
+
+    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    await message.answer("🕘 Недавние папки:", reply_markup=keyboard)
+
+#АРХИВ ПАПКИ
+# Архивы собираются в фоне: сборка и отправка идут минутами, и держать всё это время
+# очередь пользователя и слот пула (UserSerializationMiddleware) нельзя
+zip_slots = asyncio.Semaphore(ZIP_MAX_ACTIVE)
+zip_users: set[int] = set()  # Пользователи, чей архив сейчас собирается или ждёт слота
+zip_tasks: set[asyncio.Task] = set()  # Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+
+async def zip_and_send(bot: Bot, chat_id: int, entries: list[ZipEntry], filename: str):
+    """Скачивает файлы, собирает архив и отправляет его в чат. Одновременно работают не больше ZIP_MAX_ACTIVE."""
+    async with zip_slots:
+        with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as archive:
+            written, skipped = await write_zip(bot, entries, archive)
+            if not written:
+                await bot.send_message(chat_id, "❌ Не удалось скачать ни одного файла.")
+                return
+
+            caption = f"📦 Файлов в архиве: {written}"
+            if skipped:
+                caption += f", пропущено: {len(skipped)}"
+            try:
+                await bot.send_document(chat_id, SpooledInputFile(archive, filename=filename), caption=caption)
+            except Exception:
+                logger.exception("Ошибка отправки архива")
+                await bot.send_message(chat_id, "❌ Не удалось отправить архив.")
+
+async def run_zip_task(bot: Bot, chat_id: int, user_id: int, entries: list[ZipEntry], filename: str):
+    try:
+        await zip_and_send(bot, chat_id, entries, filename)
+    except Exception:
+        logger.exception("Ошибка сборки архива")
+    finally:
+        zip_users.discard(user_id)
+
+@router.message(Command("zip"))
+async def cmd_zip(message: Message, bot: Bot, db_pool):
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer("Использование: /zip <ID_папки>")
+        return
+
+    try:
+        folder_id = int(args[1])
+    except ValueError:
+        await message.answer("ID должен быть числом.")
+        return
+
+    user_id = message.from_user.id
+    if user_id in zip_users:
+        await message.answer("⏳ Предыдущий архив ещё собирается.")
+        return
+
+    titles = await get_folder_titles(db_pool, user_id, [folder_id])
+    if folder_id not in titles:
+        await message.answer("Папка не найдена или не принадлежит вам.")
+        return
+
+    rows = await get_subtree_files(db_pool, user_id, folder_id, ZIP_MAX_FILES + 1)
+    if not rows:
+        await message.answer("📦 В папке нет файлов.")
+        return
+    if len(rows) > ZIP_MAX_FILES:
+        await message.answer(f"❌ В папке больше {ZIP_MAX_FILES} файлов, архив не собран.")
+        return
+
+    zip_users.add(user_id)
+    task = asyncio.create_task(run_zip_task(
+        bot, message.chat.id, user_id, make_entries(rows), f"{safe_name(titles[folder_id])}.zip"
+    ))
+    zip_tasks.add(task)
+    task.add_done_callback(zip_tasks.discard)
+    await message.answer(f"⏳ Собираю архив из {len(rows)} файлов, пришлю его, когда будет готов.")
 
 #ДОБАВЛЕНИЕ ПАПКИ
 @router.message(Command("add"))
@@ -565,11 +833,8 @@ async def cmd_edit(message: Message, db_pool):
     else:
         await message.answer("❌ Узел не найден или не принадлежит вам.")
 
-@router.callback_query(F.data.startswith("edit_"))
-async def edit_callback(callback: CallbackQuery, state: FSMContext, db_pool):
-    try:
-        node_id = int(callback.data.split("_", 1)[1])
-    except ValueError:
+async def edit_callback(callback: CallbackQuery, node_id: Optional[int], state: FSMContext, db_pool):
+    if node_id is None:
         await callback.answer("Неверный ID узла.", show_alert=True)
         return
 
@@ -615,6 +880,35 @@ async def process_edit_content(message: Message, state: FSMContext, db_pool):
     await state.clear()  # выходим из состояния
 
 #ПОИСК
+async def send_search_results(message: Message, db_pool, user_id: int, results):
+    """Отправляет найденные узлы с путями, разбивая ответ на части по лимиту Telegram."""
+    response = f"Найдено {len(results)} результатов:\n\n"
+    for row in results:
+        path = await build_path_to_node(db_pool, user_id, row["id"])
+        response += f"• ID {row['id']}: {row['title']}\n  Путь: {path}\n\n"
+
+    # Telegram имеет лимит ~4096 символов на сообщение
+    # Если ответ слишком длинный — разобьём на части
+    MAX_MSG_LEN = 4000
+    if len(response) <= MAX_MSG_LEN:
+        await message.answer(response)
+        return
+
+    # Простое разбиение по абзацам
+    parts = []
+    current = ""
+    for line in response.split("\n\n"):
+        if len(current) + len(line) + 2 > MAX_MSG_LEN:
+            parts.append(current)
+            current = line
+        else:
+            current = current + "\n\n" + line if current else line
+    if current:
+        parts.append(current)
+
+    for part in parts:
+        await message.answer(part)
+
 @router.message(Command("search"))
 async def cmd_search(message: Message, db_pool):
     args = message.text.split(maxsplit=1)
@@ -634,43 +928,81 @@ async def cmd_search(message: Message, db_pool):
         await message.answer("🔍 Ничего не найдено.")
         return
 
-    response = f"Найдено {len(results)} результатов:\n\n"
-    for row in results:
-        path = await build_path_to_node(db_pool, row["id"])
-        response += f"• ID {row['id']}: {row['content']}\n  Путь: {path}\n\n"
+    await send_search_results(message, db_pool, user_id, results)
 
-    # Telegram имеет лимит ~4096 символов на сообщение
-    # Если ответ слишком длинный — разобьём на части
-    MAX_MSG_LEN = 4000
-    if len(response) <= MAX_MSG_LEN:
-        await message.answer(response)
+#ТЕГИ
+@router.message(Command("tag"))
+async def cmd_tag(message: Message, db_pool):
+    parts = message.text.split()  # /tag <id> тег1 -тег2
+    if len(parts) < 3:
+        await message.answer("Использование: /tag <ID> тег1 тег2 (-тег — убрать тег)")
+        return
+
+    try:
+        node_id = int(parts[1])
+    except ValueError:
+        await message.answer("ID должен быть числом.")
+        return
+
+    add = parse_tags([w for w in parts[2:] if not w.startswith("-")])
+    remove = parse_tags([w[1:] for w in parts[2:] if w.startswith("-")])
+    if add is None or remove is None:
+        await message.answer(f"❌ Тег может содержать только буквы, цифры, '_' и '-', до {MAX_TAG_LENGTH} символов.")
+        return
+
+    user_id = message.from_user.id
+    tags = await update_node_tags(db_pool, user_id, node_id, add, remove)
+
+    if tags is None:
+        await message.answer(f"❌ Узел не найден, не принадлежит вам или у него больше {MAX_TAGS_PER_NODE} тегов.")
+    elif tags:
+        await message.answer(f"🏷️ Теги узла {node_id}: " + " ".join(f"#{t}" for t in tags))
     else:
-        # Простое разбиение по абзацам
-        parts = []
-        current = ""
-        for line in response.split("\n\n"):
-            if len(current) + len(line) + 2 > MAX_MSG_LEN:
-                parts.append(current)
-                current = line
-            else:
-                current = current + "\n\n" + line if current else line
-        if current:
-            parts.append(current)
+        await message.answer(f"🏷️ У узла {node_id} больше нет тегов.")
+
+@router.message(Command("find"))
+async def cmd_find(message: Message, db_pool):
+    args = message.text.split()[1:]
+    if not args:
+        await message.answer("Использование: /find #тег1 #тег2")
+        return
+
+    tags = parse_tags(args)
+    if tags is None:
+        await message.answer(f"❌ Тег может содержать только буквы, цифры, '_' и '-', до {MAX_TAG_LENGTH} символов.")
+        return
+
+    user_id = message.from_user.id
+    results = await find_nodes_by_tags(db_pool, user_id, tags)
+
+    if not results:
+        await message.answer("🔍 Ничего не найдено.")
+        return
+
+    await send_search_results(message, db_pool, user_id, results)
+
+@router.message(Command("tags"))
+async def cmd_tags(message: Message, db_pool):
+    rows = await get_tag_counts(db_pool, message.from_user.id)
+    if not rows:
+        await message.answer("🏷️ Тегов пока нет. Добавьте их командой /tag <ID> тег")
+        return
 
-        for part in parts:
-            await message.answer(part)
+    text = "🏷️ Ваши теги:\n\n" + "\n".join(f"#{row['tag']} — {row['count']}" for row in rows)
+    await message.answer(text)
 
 @router.message(Command("menu"))
-async def cmd_menu(message: Message, state: FSMContext, db_pool):
+async def cmd_menu(message: Message, state: FSMContext, db_pool, recent_folders):
     data = await state.get_data()
     current_folder_id = data.get("current_folder_id")
+    user_id = message.from_user.id
 
     text = "меню действий:\n\n"
 
     if current_folder_id is None:
         text += "📍 Вы в корневой папке.\n"
     else:
-        path = await build_path_to_node(db_pool, current_folder_id)
+        path = await build_path_to_node(db_pool, user_id, current_folder_id)
         text += f"📍 Текущая папка: {path}\n"
 
     buttons = [
@@ -685,9 +1017,11 @@ async def cmd_menu(message: Message, state: FSMContext, db_pool):
 
     if current_folder_id is not None:
         buttons.append([
-            InlineKeyboardButton(text="↑ В корень", callback_data="cd_root"),
+            InlineKeyboardButton(text="↑ В корень", callback_data=NodeCallback(action=NodeAction.CD).pack()),
         ])
 
+    buttons += await recent_folder_buttons(db_pool, recent_folders, user_id, RECENT_IN_MENU)
+
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
     await message.answer(text, reply_markup=keyboard)
 
@@ -716,7 +1050,7 @@ async def action_ls(callback: CallbackQuery, state: FSMContext, db_pool):
         text = "Папка пуста."
     else:
         for row in children:
-            text += f"📁 {row['id']}: {row['content']}\n"
+            text += f"📁 {row['id']}: {row['title']}\n"
 
     await callback.message.answer(text)
     await callback.answer()
@@ -756,29 +1090,36 @@ async def process_search_query(message: Message, state: FSMContext, db_pool):
     if not results:
         await message.answer("🔍 Ничего не найдено.")
     else:
-        response = f"Найдено {len(results)} результатов:\n\n"
-        for row in results:
-            path = await build_path_to_node(db_pool, row["id"])
-            response += f"• ID {row['id']}: {row['content']}\n  Путь: {path}\n\n"
-
-        MAX_MSG_LEN = 4000
-        if len(response) <= MAX_MSG_LEN:
-            await message.answer(response)
-        else:
-            parts = []
-            current = ""
-            for line in response.split("\n\n"):
-                if len(current) + len(line) + 2 > MAX_MSG_LEN:
-                    parts.append(current)
-                    current = line
-                else:
-                    current = current + "\n\n" + line if current else line
-            if current:
-                parts.append(current)
-            for part in parts:
-                await message.answer(part)
+        await send_search_results(message, db_pool, user_id, results)
 
     await state.clear()  # выходим из состояния поиска
 
+#ОБРАБОТКА КНОПОК УЗЛОВ
+# Действие из NodeCallback -> обработчик. Обработчики принимают (callback, node_id) и только те
+# зависимости (state, db_pool, recent_folders, ...), которые объявляют сами — как обычные хендлеры aiogram.
+# callback_data разбирается один раз фильтром.
+CALLBACK_HANDLERS = {
+    NodeAction.VIEW: CallableObject(view_media),
+    NodeAction.REMOVE: CallableObject(rm_callback),
+    NodeAction.CD: CallableObject(cd_to_folder),
+    NodeAction.EDIT: CallableObject(edit_callback),
+    NodeAction.OPEN: CallableObject(open_note),
+}
+
+@router.callback_query(NodeCallback.filter())
+async def node_callback(callback: CallbackQuery, callback_data: NodeCallback, **kwargs):
+    handler = CALLBACK_HANDLERS[callback_data.action]
+    # В логах и выборке записей хендлер виден под своим именем, а не как node_callback.
+    # Значение сбрасывает HandlerTimingMiddleware после записи времени выполнения
+    handler_var.set(handler.callback.__name__)
+    await handler.call(callback, callback_data.node_id, **kwargs)
+
+#УСТАРЕВШИЕ КНОПКИ
+# Регистрируется последним, поэтому срабатывает только для нажатий, которые не разобрал ни один хендлер выше:
+# например, кнопки старого формата (cd_12, rm_5, cd_root) в уже отправленных сообщениях
+@router.callback_query()
+async def stale_callback(callback: CallbackQuery):
+    await callback.answer("Кнопка устарела, откройте /ls", show_alert=True)
+
 def register_handlers(dp):
     dp.include_router(router)
\ No newline at end of file
@@ -0,0 +1,19 @@
+from enum import Enum
+from typing import Optional
+
+from aiogram.filters.callback_data import CallbackData
+
+
+class NodeAction(str, Enum):
+    VIEW = "v"
+    REMOVE = "r"
+    CD = "c"
+    EDIT = "e"
+    OPEN = "o"
+
+
+class NodeCallback(CallbackData, prefix="n"):
+    # Упаковывается в строку вида "n:c:123:" — короче 64 байт даже с курсором
+    action: NodeAction
+    node_id: Optional[int] = None  # None = корневая папка
+    cursor: Optional[int] = None  # позиция в списке для постраничного вывода
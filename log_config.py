@@ -0,0 +1,127 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# Контекст текущего апдейта, заполняется middleware и попадает в каждую запись лога
+update_id_var: ContextVar[Optional[int]] = ContextVar("update_id", default=None)
+user_id_var: ContextVar[Optional[int]] = ContextVar("user_id", default=None)
+handler_var: ContextVar[Optional[str]] = ContextVar("handler", default=None)
+
+# Логгеры, которые пишут на каждый апдейт, и сколько их записей пропускать в секунду
+NOISY_LOGGERS = {"aiogram.event"}
+SAMPLE_PER_SECOND = 5
+LOG_QUEUE_SIZE = 10000  # При переполнении записи отбрасываются, а не блокируют цикл событий
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись id апдейта, id пользователя и имя хендлера."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.user_id = user_id_var.get()
+        if not hasattr(record, "handler"):
+            record.handler = handler_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает не больше per_second записей в секунду для каждого шумного события.
+    Шумным считается запись из NOISY_LOGGERS или запись с extra={"sampled": True}.
+    Событие — логгер, шаблон сообщения и хендлер, поэтому частый хендлер не вытесняет редкие.
+    Число отброшенных записей попадает в поле suppressed следующей пропущенной.
+    """
+
+    def __init__(self, per_second: int = SAMPLE_PER_SECOND, noisy_loggers=NOISY_LOGGERS):
+        super().__init__()
+        self.per_second = per_second
+        self.noisy_loggers = set(noisy_loggers)
+        # (логгер, шаблон сообщения, хендлер) -> [начало окна, пропущено в окне, отброшено]
+        self._windows: dict[tuple[str, str, Optional[str]], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if record.name not in self.noisy_loggers and not getattr(record, "sampled", False):
+            return True
+
+        now = time.monotonic()
+        key = (record.name, str(record.msg), getattr(record, "handler", None))
+        window = self._windows.setdefault(key, [now, 0, 0])
+        if now - window[0] >= 1:
+            window[0], window[1] = now, 0
+        if window[1] >= self.per_second:
+            window[2] += 1
+            return False
+        window[1] += 1
+        if window[2]:
+            record.suppressed = window[2]
+            window[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не ждёт при переполнении очереди и сохраняет traceback отдельно."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ("update_id", "user_id", "handler", "duration_ms", "suppressed", "job", "metrics")
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """
+    Настраивает корневой логгер: записи кладутся в очередь в цикле событий,
+    а форматируются в JSON и пишутся в stderr отдельным потоком.
+    Возвращает запущенный QueueListener, который нужно остановить при выходе.
+    """
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter())
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
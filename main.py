@@ -1,6 +1,8 @@
 import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.storage.redis import RedisStorage
 from dotenv import load_dotenv
@@ -8,18 +10,22 @@ import os
 import logging
 from db import init_db
 from handlers import register_handlers
+from scheduler import register_scheduler
+from middlewares import register_middlewares
+from log_config import setup_logging
+from recent_folders import RecentFolders
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Настройка логирования: JSON-записи пишутся отдельным потоком, а не в цикле событий
+log_listener = setup_logging(logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 async def main():
-    bot = Bot(token=os.getenv("BOT_TOKEN"))
+    # TELEGRAM_API_URL позволяет подключиться к локальному Bot API серверу или его заглушке
+    api_url = os.getenv("TELEGRAM_API_URL")
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+    bot = Bot(token=os.getenv("BOT_TOKEN"), session=session)
 
     # Используем RedisStorage для продакшена или MemoryStorage для разработки
     storage = RedisStorage.from_url(os.getenv("REDIS_URL", "redis://localhost:6379")) if os.getenv("REDIS_URL") else MemoryStorage()
@@ -37,14 +43,24 @@ async def main():
     BotCommand(command="/ls", description="Показать содержимое текущей папки"),
     BotCommand(command="/cd", description="Перейти в папку по ID"),
     BotCommand(command="/root", description="Вернуться в корень"),
+    BotCommand(command="/recent", description="Недавние папки"),
     BotCommand(command="/add", description="Добавить узел"),
     BotCommand(command="/rm", description="Удалить узел по ID"),
     BotCommand(command="/edit", description="Изменить текст узла"),
     BotCommand(command="/search", description="Поиск по заметкам"),
+    BotCommand(command="/tag", description="Добавить или убрать теги узла"),
+    BotCommand(command="/find", description="Найти узлы по тегам"),
+    BotCommand(command="/tags", description="Показать все теги"),
+    BotCommand(command="/zip", description="Скачать файлы папки архивом"),
     BotCommand(command="/menu", description="Показать меню действий"),
 ])
 
+    # Ограничитель частоты и недавние папки делят Redis с FSM, если он настроен
+    redis = storage.redis if isinstance(storage, RedisStorage) else None
+    dp["recent_folders"] = RecentFolders(redis=redis)
+    register_middlewares(dp, redis)
     register_handlers(dp)
+    register_scheduler(dp, pool)
 
     # Регистрируем обработчик ошибок
     dp.errors.register(error_handler)
@@ -63,4 +79,7 @@ async def error_handler(update, exception):
         await update.message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()
\ No newline at end of file
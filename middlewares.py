@@ -0,0 +1,261 @@
+import asyncio
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.enums import ContentType
+from aiogram.types import Message, TelegramObject, Update
+
+from db import DB_POOL_MAX_SIZE
+from log_config import handler_var, update_id_var, user_id_var
+
+logger = logging.getLogger(__name__)
+
+# Константы для ограничения частоты запросов
+THROTTLE_RATE = 2.0  # Сколько апдейтов в секунду восстанавливается у пользователя
+THROTTLE_BURST = 5  # Сколько апдейтов подряд можно отправить без ожидания
+MEDIA_THROTTLE_RATE = 1.0  # Сколько файлов в секунду восстанавливается у пользователя
+MEDIA_THROTTLE_BURST = 20  # Сколько файлов подряд можно отправить: два полных альбома по 10
+DUPLICATE_CALLBACK_WINDOW = 1.0  # Окно (сек), в котором одинаковое нажатие считается повтором
+MAX_TRACKED_USERS = 10000  # После этого порога из памяти вычищаются старые записи
+MAX_PENDING_PER_USER = 5  # Сколько апдейтов пользователя может ждать своей очереди
+MAX_PENDING_FILES_PER_USER = 20  # То же для файлов: помещаются два полных альбома по 10
+
+# Атомарный token bucket в Redis: пополняет ведро по времени и забирает один токен
+REDIS_BUCKET_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return allowed
+"""
+
+
+# Типы сообщений, для которых есть хендлеры сохранения файла
+FILE_CONTENT_TYPES = frozenset({
+    ContentType.DOCUMENT, ContentType.PHOTO, ContentType.VIDEO,
+    ContentType.AUDIO, ContentType.VOICE, ContentType.ANIMATION,
+})
+
+
+def carries_file(message: Optional[Message]) -> bool:
+    """Сообщение с файлом, который бот сохраняет (фото, документ, часть альбома и т.п.)."""
+    return message is not None and message.content_type in FILE_CONTENT_TYPES
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Отбрасывает апдейты от пользователей, превысивших лимит, и повторные нажатия
+    одной и той же кнопки до того, как хендлеры обратятся к db_pool.
+    У файлов своё ведро с большим запасом: альбом приходит десятком апдейтов сразу.
+    Если передан redis — состояние хранится в нём и общее для всех процессов бота.
+    """
+
+    def __init__(self, redis=None, rate: float = THROTTLE_RATE, burst: int = THROTTLE_BURST,
+                 media_rate: float = MEDIA_THROTTLE_RATE, media_burst: int = MEDIA_THROTTLE_BURST,
+                 duplicate_window: float = DUPLICATE_CALLBACK_WINDOW):
+        self.redis = redis
+        self.duplicate_window = duplicate_window
+        # вид ведра -> (скорость пополнения, размер)
+        self.limits = {"updates": (rate, burst), "media": (media_rate, media_burst)}
+        # (вид ведра, user_id) -> (токены, время последнего обновления)
+        self._buckets: Dict[tuple[str, int], tuple[float, float]] = {}
+        # (user_id, ключ) -> до какого момента ключ считается недавним
+        # (нажатия кнопок и предупреждения об ограничении)
+        self._recent: Dict[tuple[int, str], float] = {}
+        self._bucket_script = redis.register_script(REDIS_BUCKET_SCRIPT) if redis else None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        callback = event.callback_query if isinstance(event, Update) else None
+        message = event.message if isinstance(event, Update) else None
+
+        if callback is not None and callback.data and await self._seen_recently(
+                user.id, f"cb:{callback.data}", self.duplicate_window):
+            logger.debug(f"Повторное нажатие {callback.data} от {user.id} отброшено")
+            await callback.answer()
+            return None
+
+        kind = "media" if carries_file(message) else "updates"
+        if not await self._allow(kind, user.id):
+            logger.debug(f"Апдейт от {user.id} отброшен ограничителем частоты ({kind})")
+            if callback is not None:
+                await callback.answer("⏳ Слишком часто, подождите немного.")
+            elif message is not None:
+                # Предупреждаем не чаще раза за время, пока ведро наполняется заново
+                rate, burst = self.limits[kind]
+                if not await self._seen_recently(user.id, f"warned:{kind}", burst / rate):
+                    await message.reply("⏳ Слишком часто, это сообщение не обработано. Подождите немного.")
+            return None
+
+        return await handler(event, data)
+
+    async def _allow(self, kind: str, user_id: int) -> bool:
+        """Забирает токен из ведра пользователя. Возвращает False, если ведро пустое."""
+        rate, burst = self.limits[kind]
+        now = time.monotonic()
+        if self._bucket_script is not None:
+            allowed = await self._bucket_script(
+                keys=[f"throttle:{kind}:{user_id}"],
+                args=[rate, burst, time.time()],
+            )
+            return bool(allowed)
+
+        tokens, ts = self._buckets.get((kind, user_id), (burst, now))
+        tokens = min(burst, tokens + (now - ts) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[(kind, user_id)] = (tokens, now)
+
+        if len(self._buckets) > MAX_TRACKED_USERS:
+            # Полное ведро ничем не отличается от отсутствующего — такие записи можно удалить
+            self._buckets = {
+                key: b for key, b in self._buckets.items()
+                if now - b[1] < self.limits[key[0]][1] / self.limits[key[0]][0]
+            }
+        return allowed
+
+    async def _seen_recently(self, user_id: int, key: str, window: float) -> bool:
+        """Проверяет, был ли ключ у пользователя в последние window секунд, и запоминает его."""
+        if self.redis is not None:
+            is_new = await self.redis.set(
+                f"throttle:{key}:{user_id}", 1, px=int(window * 1000), nx=True,
+            )
+            return not is_new
+
+        now = time.monotonic()
+        expires = self._recent.get((user_id, key))
+        if expires is not None and now < expires:
+            return True
+        self._recent[(user_id, key)] = now + window
+
+        if len(self._recent) > MAX_TRACKED_USERS:
+            self._recent = {k: exp for k, exp in self._recent.items() if now < exp}
+        return False
+
+
+class UserSerializationMiddleware(BaseMiddleware):
+    """
+    Обрабатывает апдейты одного пользователя строго по очереди, а разных
+    пользователей — параллельно, но не больше max_concurrency одновременно.
+    Если очередь пользователя переполнена, новые апдейты отбрасываются.
+    Для файлов порог выше, чтобы альбом не терял фотографии, но он тоже ограничен.
+    """
+
+    def __init__(self, max_concurrency: int, max_pending: int = MAX_PENDING_PER_USER,
+                 max_pending_files: int = MAX_PENDING_FILES_PER_USER):
+        self.max_pending = max_pending
+        self.max_pending_files = max_pending_files
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # user_id -> замок пользователя; удаляется, когда у пользователя не остаётся апдейтов
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # user_id -> сколько апдейтов пользователя сейчас обрабатывается или ждёт
+        self._pending: Dict[int, int] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            async with self._semaphore:
+                return await handler(event, data)
+
+        pending = self._pending.get(user.id, 0)
+        message = event.message if isinstance(event, Update) else None
+        max_pending = self.max_pending_files if carries_file(message) else self.max_pending
+        if pending > max_pending:
+            logger.warning(f"Очередь пользователя {user.id} переполнена, апдейт отброшен")
+            if isinstance(event, Update) and event.callback_query is not None:
+                await event.callback_query.answer("⏳ Предыдущие действия ещё выполняются.")
+            elif message is not None:
+                await message.reply("⏳ Предыдущие действия ещё выполняются, это сообщение не обработано.")
+            return None
+
+        self._pending[user.id] = pending + 1
+        lock = self._locks.setdefault(user.id, asyncio.Lock())
+        try:
+            # Сначала ждём свою очередь, и только потом занимаем общий слот,
+            # чтобы ожидающие пользователи не держали слоты пула
+            async with lock:
+                async with self._semaphore:
+                    return await handler(event, data)
+        finally:
+            self._pending[user.id] -= 1
+            if self._pending[user.id] == 0:
+                del self._pending[user.id]
+                del self._locks[user.id]
+
+
+class LoggingContextMiddleware(BaseMiddleware):
+    """Запоминает id апдейта и пользователя, чтобы они попадали во все записи лога."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        update_token = update_id_var.set(event.update_id if isinstance(event, Update) else None)
+        user_token = user_id_var.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            update_id_var.reset(update_token)
+            user_id_var.reset(user_token)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Логирует имя сработавшего хендлера и время его выполнения."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else None
+        token = handler_var.set(name)
+        started = time.monotonic()
+        try:
+            return await handler(event, data)
+        finally:
+            duration_ms = round((time.monotonic() - started) * 1000, 2)
+            # Хендлер мог уточнить имя (см. node_callback), поэтому оно читается из handler_var
+            logger.info("Хендлер выполнен", extra={"duration_ms": duration_ms, "sampled": True})
+            handler_var.reset(token)
+
+
+def register_middlewares(dp, redis: Optional[Any] = None, max_concurrency: int = DB_POOL_MAX_SIZE):
+    # outer-middleware на update срабатывает раньше фильтров и хендлеров,
+    # в порядке регистрации: лишние апдейты отбрасываются до постановки в очередь
+    dp.update.outer_middleware(LoggingContextMiddleware())
+    dp.update.outer_middleware(ThrottlingMiddleware(redis=redis))
+    dp.update.outer_middleware(UserSerializationMiddleware(max_concurrency=max_concurrency))
+    # inner-middleware срабатывают уже после выбора хендлера, в том числе во вложенных роутерах
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
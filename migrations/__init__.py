@@ -0,0 +1,21 @@
+async def create_index_online(conn, name: str, definition: str):
+    """Создаёт индекс на nodes без блокировки записи, в том числе для секционированной nodes."""
+    is_partitioned = await conn.fetchval(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = 'nodes'::regclass"
+    )
+    if not is_partitioned:
+        await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON nodes {definition}")
+        return
+
+    # CONCURRENTLY не поддерживается для секционированных таблиц:
+    # создаём пустой индекс на родителе и подключаем к нему индексы секций
+    await conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY nodes {definition}")
+    partitions = await conn.fetch("SELECT inhrelid::regclass::text AS name FROM pg_inherits WHERE inhparent = 'nodes'::regclass")
+    for row in partitions:
+        part_index = f"{row['name']}_{name}"
+        await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {part_index} ON {row['name']} {definition}")
+        attached = await conn.fetchval(
+            "SELECT 1 FROM pg_inherits WHERE inhrelid = $1::regclass", part_index
+        )
+        if not attached:
+            await conn.execute(f"ALTER INDEX {name} ATTACH PARTITION {part_index}")
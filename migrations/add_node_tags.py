@@ -0,0 +1,100 @@
+"""
+Добавляет теги узлов: массив nodes.tags с GIN-индексом (user_id, tags) и таблицу
+tag_counts с количеством узлов по каждому тегу пользователя.
+
+tag_counts поддерживается триггером на nodes, поэтому учитывает и каскадное
+удаление вложенных узлов, и /tags не делает GROUP BY по всем узлам.
+
+Запуск: python -m migrations.add_node_tags
+"""
+import asyncio
+import logging
+
+from db import init_db
+from migrations import create_index_online
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "nodes_tags_idx"
+# btree_gin позволяет положить user_id в тот же GIN-индекс: поиск по тегам
+# проверяет user_id = $1 по индексу, а не по строкам всех пользователей с этим тегом
+INDEX_COLUMNS = "USING GIN (user_id, tags)"
+
+
+async def add_tags(conn):
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    # DEFAULT-константа не переписывает таблицу (PostgreSQL 11+)
+    await conn.execute("ALTER TABLE nodes ADD COLUMN IF NOT EXISTS tags TEXT[] NOT NULL DEFAULT '{}'")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS tag_counts (
+            user_id BIGINT NOT NULL,
+            tag TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, tag)
+        )
+    """)
+
+
+async def install_counts_trigger(conn):
+    await conn.execute("""
+        CREATE OR REPLACE FUNCTION nodes_tag_counts() RETURNS trigger AS $$
+        DECLARE
+            old_tags TEXT[] := '{}';
+            new_tags TEXT[] := '{}';
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                old_tags := OLD.tags;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                new_tags := NEW.tags;
+            END IF;
+
+            -- Убираем теги, которых больше нет у узла
+            IF TG_OP <> 'INSERT' THEN
+                UPDATE tag_counts SET count = count - 1
+                WHERE user_id = OLD.user_id
+                  AND tag = ANY (old_tags)
+                  AND NOT (tag = ANY (new_tags));
+                DELETE FROM tag_counts WHERE user_id = OLD.user_id AND count <= 0;
+            END IF;
+
+            -- Добавляем новые теги
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO tag_counts (user_id, tag, count)
+                SELECT NEW.user_id, t, 1
+                FROM unnest(new_tags) AS t
+                WHERE NOT (t = ANY (old_tags))
+                ON CONFLICT (user_id, tag) DO UPDATE SET count = tag_counts.count + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    await conn.execute("DROP TRIGGER IF EXISTS nodes_tag_counts_trg ON nodes")
+    # Для UPDATE срабатывает только при изменении tags
+    await conn.execute("""
+        CREATE TRIGGER nodes_tag_counts_trg
+        AFTER INSERT OR DELETE OR UPDATE OF tags ON nodes
+        FOR EACH ROW EXECUTE FUNCTION nodes_tag_counts()
+    """)
+
+
+async def migrate():
+    pool = await init_db()
+    try:
+        async with pool.acquire() as conn:
+            await add_tags(conn)
+            await install_counts_trigger(conn)
+            await create_index_online(conn, INDEX_NAME, INDEX_COLUMNS)
+        logger.info("Теги узлов добавлены")
+    finally:
+        await pool.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(migrate())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Добавляет в nodes короткий заголовок title для списков и поиска.
+
+Шаги:
+1. Добавляются колонки title и title_truncated (content не совпадает с title).
+   Для content включается сжатие lz4, если сервер его поддерживает (PostgreSQL 14+).
+2. Ставится триггер nodes_fill_title_trg: он заполняет title и title_truncated
+   из content при каждой вставке и изменении content. Так старый код, который
+   про title не знает, продолжает работать и во время миграции, и после неё.
+3. title и title_truncated заполняются пачками из content у существующих строк,
+   после чего title становится NOT NULL.
+4. Строится индекс (user_id, parent_id, id) INCLUDE (title, title_truncated, file_type),
+   чтобы get_children читал только индекс. Для секционированной nodes
+   (см. partition_nodes) индекс строится по секциям без блокировки записи.
+
+После того как новый код бота (сам пишет title) выкачен везде, триггер
+больше не нужен и удаляется отдельным запуском с --drop-trigger.
+
+Порядок относительно partition_nodes не важен: она переносит все колонки,
+индексы и триггеры nodes.
+
+Запуск: python -m migrations.add_node_titles [--batch-size 5000]
+        python -m migrations.add_node_titles --drop-trigger
+"""
+import argparse
+import asyncio
+import logging
+
+from db import init_db
+from handlers import TITLE_LENGTH
+from migrations import create_index_online
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+INDEX_NAME = "nodes_user_parent_title_idx"
+INDEX_COLUMNS = "(user_id, parent_id, id) INCLUDE (title, title_truncated, file_type)"
+
+
+async def add_columns(conn):
+    await conn.execute("ALTER TABLE nodes ADD COLUMN IF NOT EXISTS title TEXT")
+    await conn.execute("ALTER TABLE nodes ADD COLUMN IF NOT EXISTS title_truncated BOOLEAN NOT NULL DEFAULT false")
+
+    # lz4 появился в PostgreSQL 14 и доступен, только если сервер собран с ним
+    lz4_supported = await conn.fetchval("""
+        SELECT current_setting('server_version_num')::int >= 140000
+           AND EXISTS (
+               SELECT 1 FROM pg_settings
+               WHERE name = 'default_toast_compression' AND 'lz4' = ANY (enumvals)
+           )
+    """)
+    if lz4_supported:
+        # Сжимаются только новые и изменённые значения, старые остаются как есть
+        await conn.execute("ALTER TABLE nodes ALTER COLUMN content SET COMPRESSION lz4")
+    else:
+        logger.info("lz4 не поддерживается сервером, сжатие content не меняется")
+
+
+def title_sql(content: str) -> str:
+    """SQL-выражение заголовка из content, совпадает с make_title() из handlers."""
+    first_line = f"split_part({content}, E'\\n', 1)"
+    return f"""CASE
+        WHEN char_length({first_line}) > {TITLE_LENGTH}
+            THEN left({first_line}, {TITLE_LENGTH - 1}) || '…'
+        ELSE {first_line}
+    END"""
+
+
+async def install_title_trigger(conn):
+    """Заполняет title и title_truncated так же, как make_title_fields(), для записей старого кода."""
+    await conn.execute(f"""
+        CREATE OR REPLACE FUNCTION nodes_fill_title() RETURNS trigger AS $$
+        BEGIN
+            NEW.title := {title_sql("NEW.content")};
+            NEW.title_truncated := NEW.title <> NEW.content;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    await conn.execute("DROP TRIGGER IF EXISTS nodes_fill_title_trg ON nodes")
+    await conn.execute("""
+        CREATE TRIGGER nodes_fill_title_trg
+        BEFORE INSERT OR UPDATE OF content ON nodes
+        FOR EACH ROW EXECUTE FUNCTION nodes_fill_title()
+    """)
+
+
+async def drop_title_trigger(conn):
+    await conn.execute("DROP TRIGGER IF EXISTS nodes_fill_title_trg ON nodes")
+    await conn.execute("DROP FUNCTION IF EXISTS nodes_fill_title()")
+
+
+async def backfill_titles(pool, batch_size: int) -> int:
+    """
+    Заполняет title и title_truncated пачками. Ключи читаются одним курсором,
+    чтобы не сканировать таблицу заново на каждую пачку. Строки, вставленные
+    после установки триггера, уже заполнены, поэтому одного прохода достаточно.
+    """
+    filled = 0
+    async with pool.acquire() as reader:
+        async with reader.transaction():
+            cursor = await reader.cursor("SELECT user_id, id FROM nodes WHERE title IS NULL")
+            while True:
+                keys = await cursor.fetch(batch_size)
+                if not keys:
+                    return filled
+                async with pool.acquire() as conn:
+                    result = await conn.execute(f"""
+                        UPDATE nodes SET (title, title_truncated) = (
+                            SELECT t, t <> content FROM (SELECT {title_sql("content")} AS t) AS made
+                        )
+                        WHERE (user_id, id) IN (SELECT * FROM unnest($1::bigint[], $2::bigint[]))
+                          AND title IS NULL
+                    """, [k["user_id"] for k in keys], [k["id"] for k in keys])
+                filled += int(result.split()[-1])
+                logger.info(f"Заполнено заголовков: {filled}")
+
+
+async def set_title_not_null(conn):
+    """
+    Делает title NOT NULL. Проверка идёт через CHECK NOT VALID + VALIDATE, который не блокирует запись,
+    после чего SET NOT NULL берёт короткую блокировку и не сканирует таблицу.
+    Старый код при этом не ломается: title за него заполняет триггер.
+    """
+    await conn.execute("ALTER TABLE nodes DROP CONSTRAINT IF EXISTS nodes_title_not_null")
+    await conn.execute("ALTER TABLE nodes ADD CONSTRAINT nodes_title_not_null CHECK (title IS NOT NULL) NOT VALID")
+    await conn.execute("ALTER TABLE nodes VALIDATE CONSTRAINT nodes_title_not_null")
+    await conn.execute("ALTER TABLE nodes ALTER COLUMN title SET NOT NULL")
+    await conn.execute("ALTER TABLE nodes DROP CONSTRAINT nodes_title_not_null")
+
+
+async def migrate(batch_size: int):
+    pool = await init_db()
+    try:
+        async with pool.acquire() as conn:
+            await add_columns(conn)
+            await install_title_trigger(conn)
+        filled = await backfill_titles(pool, batch_size)
+        logger.info(f"Заполнение завершено, всего {filled} заголовков")
+        async with pool.acquire() as conn:
+            await set_title_not_null(conn)
+            await create_index_online(conn, INDEX_NAME, INDEX_COLUMNS)
+            await conn.execute("ANALYZE nodes")
+        logger.info("Заголовки узлов добавлены. После выкатки нового кода запустите с --drop-trigger")
+    finally:
+        await pool.close()
+
+
+async def finish():
+    pool = await init_db()
+    try:
+        async with pool.acquire() as conn:
+            await drop_title_trigger(conn)
+        logger.info("Триггер заполнения заголовков удалён")
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Добавление заголовков узлов")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--drop-trigger", action="store_true",
+                        help="удалить триггер заполнения title, когда старый код больше не работает")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.drop_trigger:
+        asyncio.run(finish())
+    else:
+        asyncio.run(migrate(args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
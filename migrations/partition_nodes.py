@@ -0,0 +1,240 @@
+"""
+Онлайн-миграция таблицы nodes в таблицу, секционированную по HASH(user_id).
+
+Шаги:
+1. Создаётся nodes_new (LIKE nodes) с NODES_PARTITIONS секциями nodes_p0..nodes_pN
+   и копиями неуникальных индексов nodes. Колонки берутся из pg_attribute,
+   поэтому title, tags и любые другие колонки nodes переносятся как есть.
+2. На nodes вешается триггер, который зеркалирует все изменения в nodes_new.
+3. Существующие строки копируются пачками по id. На время одной пачки nodes
+   блокируется в режиме SHARE (чтение разрешено, запись ждёт миллисекунды).
+4. На каждую секцию добавляется внешний ключ parent -> id как NOT VALID
+   (мгновенно) и затем проверяется VALIDATE CONSTRAINT — проверка не блокирует
+   запись ни в nodes, ни в nodes_new.
+5. Под короткой блокировкой таблицы меняются местами: nodes -> nodes_old,
+   nodes_new -> nodes; пользовательские триггеры nodes (например, подсчёт тегов)
+   переносятся на новую таблицу, индексы получают исходные имена.
+
+Старая таблица остаётся как nodes_old, удалить её можно вручную после проверки.
+Предполагается, что nodes.id — SERIAL/BIGSERIAL.
+
+Запуск: python -m migrations.partition_nodes [--partitions 16] [--batch-size 5000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+
+from db import init_db
+
+logger = logging.getLogger(__name__)
+
+NODES_PARTITIONS = int(os.getenv("NODES_PARTITIONS", 16))
+BATCH_SIZE = 5000
+MIRROR_TRIGGER = "nodes_mirror_trg"
+USER_PARENT_INDEX = "nodes_user_parent_idx"
+
+INDEX_DEF_RE = re.compile(r"^CREATE INDEX (\S+) ON (?:ONLY )?\S+ ")
+
+
+async def get_columns(conn) -> list[str]:
+    """Возвращает колонки nodes (уже экранированные) в порядке объявления."""
+    rows = await conn.fetch("""
+        SELECT quote_ident(attname) AS name
+        FROM pg_attribute
+        WHERE attrelid = 'nodes'::regclass AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+    """)
+    return [row["name"] for row in rows]
+
+
+async def get_index_defs(conn, table: str) -> dict[str, str]:
+    """Возвращает неуникальные индексы таблицы: {имя: CREATE INDEX ...}."""
+    rows = await conn.fetch("""
+        SELECT c.relname AS name, pg_get_indexdef(i.indexrelid) AS def
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = $1::regclass AND NOT i.indisunique
+    """, table)
+    return {row["name"]: row["def"] for row in rows}
+
+
+async def create_partitioned_table(conn, partitions: int):
+    """Создаёт nodes_new с секциями и индексами, если её ещё нет."""
+    exists = await conn.fetchval("SELECT to_regclass('nodes_new') IS NOT NULL")
+    if exists:
+        return
+
+    # LIKE переносит все колонки, NOT NULL, значения по умолчанию (в том числе nextval для id) и CHECK
+    await conn.execute("""
+        CREATE TABLE nodes_new (LIKE nodes INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY HASH (user_id)
+    """)
+    await conn.execute("ALTER TABLE nodes_new ADD PRIMARY KEY (user_id, id)")
+    for i in range(partitions):
+        await conn.execute(f"""
+            CREATE TABLE nodes_p{i} PARTITION OF nodes_new
+            FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})
+        """)
+
+    # Индекс под get_children: user_id + parent_id, отсортировано по id
+    await conn.execute(f"CREATE INDEX {USER_PARENT_INDEX}_new ON nodes_new (user_id, parent_id, id)")
+    # Остальные индексы nodes (заголовки, теги и т.п.) создаются под временными именами;
+    # таблица пока пустая, поэтому это быстро
+    for name, definition in (await get_index_defs(conn, "nodes")).items():
+        if name == USER_PARENT_INDEX:
+            continue
+        await conn.execute(INDEX_DEF_RE.sub(f"CREATE INDEX {name}_new ON nodes_new ", definition))
+
+
+async def install_mirror_trigger(conn, columns: list[str]):
+    """Зеркалирует INSERT/UPDATE/DELETE из nodes в nodes_new, пока идёт копирование."""
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"NEW.{c}" for c in columns)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in ("id", "user_id"))
+    await conn.execute(f"""
+        CREATE OR REPLACE FUNCTION nodes_mirror() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM nodes_new WHERE user_id = OLD.user_id AND id = OLD.id;
+                RETURN OLD;
+            END IF;
+            IF TG_OP = 'UPDATE' AND OLD.user_id IS DISTINCT FROM NEW.user_id THEN
+                DELETE FROM nodes_new WHERE user_id = OLD.user_id AND id = OLD.id;
+            END IF;
+            INSERT INTO nodes_new ({column_list})
+            VALUES ({new_values})
+            ON CONFLICT (user_id, id) DO UPDATE SET {updates};
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    await conn.execute(f"DROP TRIGGER IF EXISTS {MIRROR_TRIGGER} ON nodes")
+    await conn.execute(f"""
+        CREATE TRIGGER {MIRROR_TRIGGER}
+        AFTER INSERT OR UPDATE OR DELETE ON nodes
+        FOR EACH ROW EXECUTE FUNCTION nodes_mirror()
+    """)
+
+
+async def copy_batches(pool, columns: list[str], batch_size: int) -> int:
+    """Копирует строки из nodes в nodes_new пачками по возрастанию id. Возвращает число строк."""
+    column_list = ", ".join(columns)
+    last_id = 0
+    copied = 0
+    while True:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # SHARE не мешает чтению, но не даёт строкам пачки измениться во время копирования
+                await conn.execute("LOCK TABLE nodes IN SHARE MODE")
+                row = await conn.fetchrow(f"""
+                    WITH batch AS (
+                        SELECT {column_list}
+                        FROM nodes
+                        WHERE id > $1
+                        ORDER BY id
+                        LIMIT $2
+                    ), ins AS (
+                        INSERT INTO nodes_new ({column_list})
+                        SELECT {column_list} FROM batch
+                        ON CONFLICT (user_id, id) DO NOTHING
+                    )
+                    SELECT count(*) AS n, max(id) AS last_id FROM batch
+                """, last_id, batch_size)
+        if row["n"] == 0:
+            return copied
+        copied += row["n"]
+        last_id = row["last_id"]
+        logger.info(f"Скопировано {copied} строк (последний id {last_id})")
+
+
+async def add_parent_keys(conn):
+    """
+    Добавляет внешний ключ parent -> id на каждую секцию.
+    На секционированную таблицу целиком NOT VALID добавить нельзя, а полная проверка
+    держала бы блокировку, останавливающую запись через зеркальный триггер.
+    NOT VALID на секции ставится мгновенно, а VALIDATE берёт только
+    SHARE UPDATE EXCLUSIVE, который запись не блокирует.
+    Все узлы одного пользователя лежат в одной секции, поэтому родитель всегда рядом.
+    """
+    partitions = await conn.fetch(
+        "SELECT inhrelid::regclass::text AS name FROM pg_inherits WHERE inhparent = 'nodes_new'::regclass"
+    )
+    for row in partitions:
+        constraint = f"{row['name']}_parent_fkey"
+        exists = await conn.fetchval("SELECT 1 FROM pg_constraint WHERE conname = $1", constraint)
+        if not exists:
+            await conn.execute(f"""
+                ALTER TABLE {row['name']}
+                ADD CONSTRAINT {constraint} FOREIGN KEY (user_id, parent_id)
+                REFERENCES nodes_new (user_id, id) ON DELETE CASCADE NOT VALID
+            """)
+        await conn.execute(f"ALTER TABLE {row['name']} VALIDATE CONSTRAINT {constraint}")
+        logger.info(f"Внешний ключ {constraint} проверен")
+
+
+async def swap_tables(conn):
+    """Меняет таблицы местами одной транзакцией под короткой блокировкой."""
+    seq = await conn.fetchval("SELECT pg_get_serial_sequence('nodes', 'id')")
+    async with conn.transaction():
+        await conn.execute("LOCK TABLE nodes IN ACCESS EXCLUSIVE MODE")
+        triggers = await conn.fetch("""
+            SELECT tgname, pg_get_triggerdef(oid) AS def
+            FROM pg_trigger
+            WHERE tgrelid = 'nodes'::regclass AND NOT tgisinternal AND tgname <> $1
+        """, MIRROR_TRIGGER)
+        old_indexes = await get_index_defs(conn, "nodes")
+        new_indexes = await get_index_defs(conn, "nodes_new")
+
+        await conn.execute(f"DROP TRIGGER {MIRROR_TRIGGER} ON nodes")
+        await conn.execute("DROP FUNCTION nodes_mirror()")
+        for trigger in triggers:
+            await conn.execute(f"DROP TRIGGER {trigger['tgname']} ON nodes")
+
+        await conn.execute("ALTER TABLE nodes RENAME TO nodes_old")
+        await conn.execute("ALTER TABLE nodes_new RENAME TO nodes")
+
+        # Определения триггеров ссылаются на таблицу по имени nodes — теперь это новая таблица
+        for trigger in triggers:
+            await conn.execute(trigger["def"])
+        # Индексы новой таблицы получают имена старых, чтобы повторные миграции их узнавали
+        for name in old_indexes:
+            await conn.execute(f"ALTER INDEX {name} RENAME TO {name}_old")
+        for name in new_indexes:
+            if name.endswith("_new"):
+                await conn.execute(f"ALTER INDEX {name} RENAME TO {name[:-len('_new')]}")
+        # Последовательность переходит к новой таблице, чтобы не удалиться вместе с nodes_old
+        await conn.execute(f"ALTER SEQUENCE {seq} OWNED BY nodes.id")
+
+
+async def migrate(partitions: int, batch_size: int):
+    pool = await init_db()
+    try:
+        async with pool.acquire() as conn:
+            columns = await get_columns(conn)
+            await create_partitioned_table(conn, partitions)
+            await install_mirror_trigger(conn, columns)
+        copied = await copy_batches(pool, columns, batch_size)
+        logger.info(f"Копирование завершено, всего {copied} строк")
+        async with pool.acquire() as conn:
+            await add_parent_keys(conn)
+            await swap_tables(conn)
+            await conn.execute("ANALYZE nodes")
+        logger.info("Таблицы переключены, старые данные сохранены в nodes_old")
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Секционирование nodes по HASH(user_id)")
+    parser.add_argument("--partitions", type=int, default=NODES_PARTITIONS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(migrate(args.partitions, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Константы для списка недавних папок
+RECENT_LIMIT = 10  # Сколько папок помнить на пользователя
+RECENT_HALF_LIFE = 3 * 24 * 3600  # Через сколько секунд вклад посещения уменьшается вдвое
+RECENT_TTL = 30 * 24 * 3600  # Через сколько секунд без переходов список пользователя удаляется
+MAX_RECENT_USERS = 10000  # Сколько пользователей хранится в памяти без Redis
+
+# Оценка папки хранится в log2-шкале: log2(sum(2 ** (t / half_life))) по всем посещениям.
+# Так частые и недавние переходы поднимают папку выше, а числа не переполняются со временем.
+REDIS_VISIT_SCRIPT = """
+local visit = tonumber(ARGV[2]) / tonumber(ARGV[3])
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if score then
+    score = tonumber(score)
+    local hi = math.max(score, visit)
+    local lo = math.min(score, visit)
+    visit = hi + math.log(1 + 2 ^ (lo - hi)) / math.log(2)
+end
+redis.call('ZADD', KEYS[1], visit, ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[4]) - 1)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+return 1
+"""
+
+
+def add_visit(score: Optional[float], now: float) -> float:
+    """Добавляет посещение к оценке папки (та же формула, что в REDIS_VISIT_SCRIPT)."""
+    visit = now / RECENT_HALF_LIFE
+    if score is None:
+        return visit
+    hi, lo = max(score, visit), min(score, visit)
+    return hi + math.log2(1 + 2 ** (lo - hi))
+
+
+class RecentFolders:
+    """
+    Недавние и часто посещаемые папки пользователя.
+    С Redis хранятся в sorted set на пользователя, без него — в памяти (LRU по пользователям).
+    """
+
+    def __init__(self, redis=None, limit: int = RECENT_LIMIT):
+        self.redis = redis
+        self.limit = limit
+        # user_id -> {folder_id: оценка}; самые давно активные пользователи в начале
+        self._users: OrderedDict[int, dict[int, float]] = OrderedDict()
+        self._visit_script = redis.register_script(REDIS_VISIT_SCRIPT) if redis else None
+
+    async def visit(self, user_id: int, folder_id: int):
+        now = time.time()
+        if self._visit_script is not None:
+            await self._visit_script(
+                keys=[f"recent:{user_id}"],
+                args=[folder_id, now, RECENT_HALF_LIFE, self.limit, RECENT_TTL],
+            )
+            return
+
+        folders = self._users.pop(user_id, {})
+        folders[folder_id] = add_visit(folders.get(folder_id), now)
+        if len(folders) > self.limit:
+            del folders[min(folders, key=folders.get)]
+        self._users[user_id] = folders
+        if len(self._users) > MAX_RECENT_USERS:
+            self._users.popitem(last=False)
+
+    async def get(self, user_id: int, count: Optional[int] = None) -> list[int]:
+        """Возвращает id папок, начиная с самой востребованной."""
+        count = count or self.limit
+        if self.redis is not None:
+            members = await self.redis.zrevrange(f"recent:{user_id}", 0, count - 1)
+            return [int(m) for m in members]
+
+        folders = self._users.get(user_id, {})
+        return sorted(folders, key=folders.get, reverse=True)[:count]
+
+    async def forget(self, user_id: int, folder_ids: list[int]):
+        """Убирает папки, которых больше нет (например, удалённые)."""
+        if not folder_ids:
+            return
+        if self.redis is not None:
+            await self.redis.zrem(f"recent:{user_id}", *folder_ids)
+            return
+
+        folders = self._users.get(user_id, {})
+        for folder_id in folder_ids:
+            folders.pop(folder_id, None)
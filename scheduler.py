@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import time
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram.fsm.storage.redis import RedisStorage
+
+logger = logging.getLogger(__name__)
+
+# Константы для фоновых задач
+ANALYZE_INTERVAL = int(os.getenv("ANALYZE_INTERVAL", 3600))  # секунды
+PURGE_ORPHANS_INTERVAL = int(os.getenv("PURGE_ORPHANS_INTERVAL", 6 * 3600))
+FSM_EXPIRE_INTERVAL = int(os.getenv("FSM_EXPIRE_INTERVAL", 3600))
+FSM_DATA_TTL = int(os.getenv("FSM_DATA_TTL", 30 * 24 * 3600))  # неактивные данные FSM живут 30 дней
+JOB_TIMEOUT = 300  # Максимальное время выполнения одной задачи
+PURGE_BATCH_SIZE = 1000  # Сколько "осиротевших" узлов удаляем за один запрос
+
+# Метрики задач: имя задачи -> счётчики последнего и всех запусков
+job_metrics: dict[str, dict] = {}
+
+
+async def run_job(name: str, job, *args):
+    """Запускает задачу с ограничением по времени и записывает метрики."""
+    stats = job_metrics.setdefault(name, {
+        "runs": 0, "failures": 0, "timeouts": 0,
+        "last_duration": None, "last_result": None,
+    })
+    stats["runs"] += 1
+    stats["last_result"] = None
+    started = time.monotonic()
+    try:
+        stats["last_result"] = await asyncio.wait_for(job(*args), timeout=JOB_TIMEOUT)
+    except asyncio.TimeoutError:
+        stats["timeouts"] += 1
+        logger.warning(f"Задача {name} превысила лимит {JOB_TIMEOUT} с и была прервана")
+    except Exception:
+        stats["failures"] += 1
+        logger.exception(f"Ошибка в задаче {name}")
+    finally:
+        stats["last_duration"] = time.monotonic() - started
+        # Счётчики уходят в поля JSON-записи лога (см. log_config), откуда их собирает сборщик логов
+        logger.info(
+            f"Задача {name}: {stats['last_duration']:.2f} с, результат {stats['last_result']}, "
+            f"запусков {stats['runs']}, ошибок {stats['failures']}, таймаутов {stats['timeouts']}",
+            extra={"job": name, "metrics": dict(stats)}
+        )
+
+
+async def analyze_nodes(pool):
+    """Обновляет статистику планировщика запросов для таблицы nodes."""
+    async with pool.acquire() as conn:
+        await conn.execute("ANALYZE nodes")
+    return "ok"
+
+
+async def purge_orphans(pool) -> int:
+    """
+    Удаляет узлы, у которых parent_id указывает на несуществующий узел, вместе с их поддеревьями.
+    Полный проход по таблице (анти-join) выполняется один раз: рекурсивный запрос
+    собирает ключи (user_id, id) осиротевших узлов и всех их потомков.
+    Потом узлы удаляются пачками по ключу, чтобы не держать долгих блокировок
+    и попадать в одну секцию nodes, а не проверять все.
+    Возвращает количество удалённых узлов.
+    """
+    async with pool.acquire() as conn:
+        keys = await conn.fetch("""
+            WITH RECURSIVE orphans AS (
+                SELECT n.user_id, n.id
+                FROM nodes n
+                WHERE n.parent_id IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM nodes p WHERE p.user_id = n.user_id AND p.id = n.parent_id
+                  )
+                UNION
+                SELECT c.user_id, c.id
+                FROM nodes c
+                JOIN orphans o ON c.user_id = o.user_id AND c.parent_id = o.id
+            )
+            SELECT user_id, id FROM orphans
+        """)
+
+    total = 0
+    for start in range(0, len(keys), PURGE_BATCH_SIZE):
+        batch = keys[start:start + PURGE_BATCH_SIZE]
+        async with pool.acquire() as conn:
+            result = await conn.execute("""
+                DELETE FROM nodes
+                WHERE (user_id, id) IN (SELECT * FROM unnest($1::bigint[], $2::bigint[]))
+            """, [k["user_id"] for k in batch], [k["id"] for k in batch])
+        # execute возвращает строку вида "DELETE 42"
+        total += int(result.split()[-1])
+    return total
+
+
+async def expire_fsm_data(storage: RedisStorage) -> int:
+    """
+    Проставляет TTL ключам FSM, у которых его нет.
+    RedisStorage сбрасывает TTL при каждой записи, поэтому истекают
+    только данные пользователей, не проявлявших активность FSM_DATA_TTL секунд.
+    """
+    redis = storage.redis
+    expired = 0
+    async for key in redis.scan_iter(match="fsm:*", count=500):
+        if await redis.ttl(key) == -1:
+            await redis.expire(key, FSM_DATA_TTL)
+            expired += 1
+    return expired
+
+
+def create_scheduler(pool, storage) -> AsyncIOScheduler:
+    """Создаёт планировщик с фоновыми задачами обслуживания."""
+    scheduler = AsyncIOScheduler()
+    # max_instances=1 и coalesce не дают задаче запускаться параллельно самой себе
+    job_defaults = {"max_instances": 1, "coalesce": True, "misfire_grace_time": 60}
+
+    scheduler.add_job(
+        run_job, "interval", seconds=ANALYZE_INTERVAL,
+        args=["analyze_nodes", analyze_nodes, pool], id="analyze_nodes", **job_defaults
+    )
+    scheduler.add_job(
+        run_job, "interval", seconds=PURGE_ORPHANS_INTERVAL,
+        args=["purge_orphans", purge_orphans, pool], id="purge_orphans", **job_defaults
+    )
+    if isinstance(storage, RedisStorage):
+        scheduler.add_job(
+            run_job, "interval", seconds=FSM_EXPIRE_INTERVAL,
+            args=["expire_fsm_data", expire_fsm_data, storage], id="expire_fsm_data", **job_defaults
+        )
+    return scheduler
+
+
+def register_scheduler(dp, pool):
+    """Привязывает запуск и остановку планировщика к жизненному циклу диспетчера."""
+    scheduler = create_scheduler(pool, dp.storage)
+
+    async def on_startup():
+        scheduler.start()
+        logger.info("Планировщик фоновых задач запущен")
+
+    async def on_shutdown():
+        scheduler.shutdown(wait=False)
+        logger.info("Планировщик фоновых задач остановлен")
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return scheduler
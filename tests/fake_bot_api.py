@@ -0,0 +1,123 @@
+"""
+Локальная заглушка Bot API для тестов и бенчмарков: getFile, скачивание файлов,
+sendDocument и sendMessage.
+
+file_id имеет вид "<размер в байтах>_<номер>", например "1048576_3":
+getFile возвращает file_path "files/1048576_3.bin", а по этому пути
+отдаётся размер байт детерминированного содержимого. file_id, начинающийся
+с "missing", возвращает ошибку, как для удалённого файла.
+
+Отправленные документы и сообщения сохраняются в app[DOCUMENTS] и app[MESSAGES].
+
+Запуск отдельно: python -m tests.fake_bot_api [--port 8081]
+и TELEGRAM_API_URL=http://localhost:8081 для бота.
+"""
+import argparse
+
+from aiohttp import web
+
+CHUNK_SIZE = 64 * 1024
+
+# Что бот отправил через заглушку: (имя файла, подпись, байты) и тексты сообщений
+DOCUMENTS = web.AppKey("documents", list)
+MESSAGES = web.AppKey("messages", list)
+
+
+def file_content(file_id: str, size: int):
+    """Генерирует содержимое файла частями, не держа его в памяти целиком."""
+    pattern = (file_id.encode() * (CHUNK_SIZE // len(file_id) + 1))[:CHUNK_SIZE]
+    sent = 0
+    while sent < size:
+        chunk = pattern[:min(CHUNK_SIZE, size - sent)]
+        sent += len(chunk)
+        yield chunk
+
+
+async def get_file(request: web.Request) -> web.Response:
+    data = await request.post()
+    file_id = data.get("file_id", "")
+    if file_id.startswith("missing"):
+        return web.json_response(
+            {"ok": False, "error_code": 400, "description": "Bad Request: file not found"}, status=400
+        )
+    size = int(file_id.split("_", 1)[0])
+    return web.json_response({"ok": True, "result": {
+        "file_id": file_id,
+        "file_unique_id": file_id,
+        "file_size": size,
+        "file_path": f"files/{file_id}.bin",
+    }})
+
+
+async def download(request: web.Request) -> web.StreamResponse:
+    file_id = request.match_info["name"].rsplit(".", 1)[0]
+    size = int(file_id.split("_", 1)[0])
+    response = web.StreamResponse(headers={"Content-Length": str(size)})
+    await response.prepare(request)
+    for chunk in file_content(file_id, size):
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+def sent_message(chat_id: str, **fields) -> dict:
+    return {"ok": True, "result": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": int(chat_id), "type": "private"},
+        **fields,
+    }}
+
+
+async def send_document(request: web.Request) -> web.Response:
+    data = await request.post()
+    document = data["document"]
+    if isinstance(document, str) and document.startswith("attach://"):
+        # aiogram передаёт файл отдельной частью формы и ссылается на неё
+        document = data[document[len("attach://"):]]
+    content = document.file.read()
+    request.app[DOCUMENTS].append((document.filename, data.get("caption"), content))
+    return web.json_response(sent_message(data["chat_id"], document={
+        "file_id": f"{len(content)}_sent",
+        "file_unique_id": f"{len(content)}_sent",
+        "file_name": document.filename,
+        "file_size": len(content),
+    }))
+
+
+async def send_message(request: web.Request) -> web.Response:
+    data = await request.post()
+    request.app[MESSAGES].append(data["text"])
+    return web.json_response(sent_message(data["chat_id"], text=data["text"]))
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app[DOCUMENTS] = []
+    app[MESSAGES] = []
+    app.router.add_post("/bot{token}/getFile", get_file)
+    app.router.add_get("/file/bot{token}/files/{name}", download)
+    app.router.add_post("/bot{token}/sendDocument", send_document)
+    app.router.add_post("/bot{token}/sendMessage", send_message)
+    return app
+
+
+async def start_server(port: int = 0) -> tuple[web.AppRunner, str]:
+    """Запускает заглушку в текущем цикле событий. Возвращает runner и базовый URL."""
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Bot API для файлов")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    web.run_app(create_app(), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import io
+import tempfile
+import zipfile
+from contextlib import asynccontextmanager
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+import archive
+from archive import SpooledInputFile, ZipEntry, write_zip
+from handlers import zip_and_send
+from tests.fake_bot_api import DOCUMENTS, MESSAGES, start_server
+
+FILE_SIZE = 100 * 1024
+CHAT_ID = 1
+
+
+@asynccontextmanager
+async def fake_bot():
+    """Бот, подключённый к заглушке Bot API. Возвращает бота и приложение заглушки."""
+    runner, base_url = await start_server()
+    bot = Bot(token="42:test", session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    try:
+        yield bot, runner.app
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+async def build_zip(entries: list[ZipEntry]):
+    """Собирает архив через заглушку Bot API. Возвращает written, skipped и байты архива."""
+    async with fake_bot() as (bot, _):
+        with tempfile.SpooledTemporaryFile() as buffer:
+            written, skipped = await write_zip(bot, entries, buffer)
+            buffer.seek(0)
+            return written, skipped, buffer.read()
+
+
+def open_zip(data: bytes) -> zipfile.ZipFile:
+    return zipfile.ZipFile(io.BytesIO(data))
+
+
+def test_write_zip_skips_missing_files():
+    entries = [ZipEntry(f"{FILE_SIZE}_{i}", f"folder/{i}_file") for i in range(5)]
+    entries += [ZipEntry("missing_1", "folder/missing")]
+
+    written, skipped, data = asyncio.run(build_zip(entries))
+
+    assert written == 5
+    assert skipped == ["folder/missing"]
+    with open_zip(data) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == sorted(f"folder/{i}_file.bin" for i in range(5))
+        assert all(info.file_size == FILE_SIZE for info in zf.infolist())
+
+
+def test_write_zip_respects_size_limit_with_headers(monkeypatch):
+    # Ровно три файла без учёта заголовков: с заголовками помещаются только два
+    monkeypatch.setattr(archive, "ZIP_MAX_SIZE", 3 * FILE_SIZE)
+    entries = [ZipEntry(f"{FILE_SIZE}_{i}", f"{i}") for i in range(3)]
+
+    written, skipped, data = asyncio.run(build_zip(entries))
+
+    assert written == 2
+    assert len(skipped) == 1
+    assert len(data) <= 3 * FILE_SIZE
+    with open_zip(data) as zf:
+        assert zf.testzip() is None
+        assert len(zf.namelist()) == 2
+
+
+def test_spooled_input_file_uploads_archive_from_disk():
+    async def run():
+        async with fake_bot() as (bot, app):
+            # max_size=1: архив сразу уходит из памяти на диск
+            with tempfile.SpooledTemporaryFile(max_size=1) as buffer:
+                await write_zip(bot, [ZipEntry(f"{FILE_SIZE}_{i}", f"{i}") for i in range(3)], buffer)
+                assert buffer._rolled
+                buffer.seek(0)
+                expected = buffer.read()
+                await bot.send_document(CHAT_ID, SpooledInputFile(buffer, filename="folder.zip"))
+            return expected, app[DOCUMENTS]
+
+    expected, documents = asyncio.run(run())
+
+    assert len(documents) == 1
+    filename, _, received = documents[0]
+    assert filename == "folder.zip"
+    assert received == expected
+
+
+def test_zip_and_send_uploads_archive():
+    async def run():
+        async with fake_bot() as (bot, app):
+            entries = [ZipEntry(f"{FILE_SIZE}_{i}", f"folder/{i}") for i in range(3)]
+            entries += [ZipEntry("missing_1", "folder/missing")]
+            await zip_and_send(bot, CHAT_ID, entries, "folder.zip")
+            return app[DOCUMENTS], app[MESSAGES]
+
+    documents, messages = asyncio.run(run())
+
+    assert messages == []
+    assert len(documents) == 1
+    filename, caption, received = documents[0]
+    assert filename == "folder.zip"
+    assert caption == "📦 Файлов в архиве: 3, пропущено: 1"
+    with open_zip(received) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == [f"folder/{i}.bin" for i in range(3)]